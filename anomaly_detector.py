@@ -1,38 +1,206 @@
 import logging
-from collections import defaultdict, deque
+import heapq
 import time
 import math
 
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # scipy is optional, fall back to a linear scan
+    cKDTree = None
+
+try:
+    from rtree import index as rtree_index
+except ImportError:  # rtree is optional, fall back to an array AABB test
+    rtree_index = None
+
+try:
+    from shapely.geometry import Polygon, box
+    from shapely.prepared import prep
+except ImportError:  # shapely is optional, polygon zones then use their bbox
+    Polygon = None
+
+from jit import njit
+
+# Returned for frames where no detector can fire
+_NO_ANOMALIES = ()
+
+
+@njit(cache=True, fastmath=True)
+def _pairwise_sqdist(a_xy, b_xy):
+    """Squared distances between every row of a_xy and every row of b_xy"""
+    dx = np.ascontiguousarray(a_xy[:, 0]).reshape(-1, 1) - np.ascontiguousarray(b_xy[:, 0]).reshape(1, -1)
+    dy = np.ascontiguousarray(a_xy[:, 1]).reshape(-1, 1) - np.ascontiguousarray(b_xy[:, 1]).reshape(1, -1)
+    return dx * dx + dy * dy
+
+
+@njit(cache=True, fastmath=True)
+def _match_gate(det_xy, det_cls, track_xy, track_cls, last_ts, ts, r2, dt, claimed):
+    """Index of the nearest recent unclaimed same-class track per detection, -1 if none"""
+    d2 = _pairwise_sqdist(det_xy, track_xy)
+    same_class = np.ascontiguousarray(det_cls).reshape(-1, 1) == np.ascontiguousarray(track_cls).reshape(1, -1)
+    gate = (d2 < r2) & same_class & ((ts - last_ts) < dt).reshape(1, -1)
+    d2 = np.where(gate, d2, r2)
+    
+    # Detections claim tracks in order, so a track takes at most one detection per frame
+    best_idx = np.full(det_xy.shape[0], -1, dtype=np.int64)
+    for i in range(det_xy.shape[0]):
+        j = np.argmin(np.where(claimed, r2, d2[i]))
+        if gate[i, j] and not claimed[j]:
+            best_idx[i] = j
+            claimed[j] = True
+    return best_idx
+
+
+class TrackTable:
+    """Tracked object state stored as parallel arrays, one row per track"""
+    MOVEMENT_HISTORY = 10
+    
+    def __init__(self, capacity=64):
+        self.rows = {}  # object id -> row index
+        self.ids = []  # row index -> object id
+        self.size = 0
+        self._allocate(capacity)
+    
+    def _allocate(self, capacity):
+        """Allocate empty arrays for the given number of rows"""
+        self.capacity = capacity
+        self.last_x = np.zeros(capacity, dtype=np.float64)
+        self.last_y = np.zeros(capacity, dtype=np.float64)
+        self.last_ts = np.zeros(capacity, dtype=np.float64)
+        self.first_seen = np.zeros(capacity, dtype=np.float64)
+        self.stationary_time = np.zeros(capacity, dtype=np.float64)
+        self.class_id = np.zeros(capacity, dtype=np.int64)
+        self.pos_count = np.zeros(capacity, dtype=np.int64)  # sightings so far, only the last position is kept
+        self.movement_ring = np.zeros((capacity, self.MOVEMENT_HISTORY), dtype=np.float32)
+        self.mv_head = np.zeros(capacity, dtype=np.int64)
+        self.mv_count = np.zeros(capacity, dtype=np.int64)
+        self.mv_sum = np.zeros(capacity, dtype=np.float64)  # running sum of movement_ring
+        self.mv_sum_sq = np.zeros(capacity, dtype=np.float64)  # running sum of squares of movement_ring
+    
+    def _fields(self):
+        return ('last_x', 'last_y', 'last_ts', 'first_seen', 'stationary_time', 'class_id',
+                'pos_count', 'movement_ring', 'mv_head', 'mv_count', 'mv_sum', 'mv_sum_sq')
+    
+    def _grow(self):
+        """Double the capacity, keeping existing rows"""
+        old = {name: getattr(self, name) for name in self._fields()}
+        self._allocate(self.capacity * 2)
+        for name, values in old.items():
+            getattr(self, name)[:self.size] = values[:self.size]
+    
+    def __len__(self):
+        return self.size
+    
+    def __contains__(self, obj_id):
+        return obj_id in self.rows
+    
+    def add(self, obj_id, class_id, timestamp):
+        """Create a new empty track and return its row"""
+        if self.size == self.capacity:
+            self._grow()
+        
+        row = self.size
+        self.rows[obj_id] = row
+        self.ids.append(obj_id)
+        self.size += 1
+        
+        for name in self._fields():
+            getattr(self, name)[row] = 0
+        self.class_id[row] = class_id
+        self.first_seen[row] = timestamp
+        return row
+    
+    def append_position(self, row, x, y, timestamp):
+        """Record the latest position of a track"""
+        self.pos_count[row] += 1
+        self.last_x[row] = x
+        self.last_y[row] = y
+        self.last_ts[row] = timestamp
+    
+    def append_movement(self, row, distance):
+        """Record the distance moved by a track since its previous position"""
+        head = self.mv_head[row]
+        if self.mv_count[row] == self.MOVEMENT_HISTORY:
+            evicted = float(self.movement_ring[row, head])
+            self.mv_sum[row] -= evicted
+            self.mv_sum_sq[row] -= evicted * evicted
+        
+        self.movement_ring[row, head] = distance
+        stored = float(self.movement_ring[row, head])  # keep the sums in step with the float32 ring
+        self.mv_sum[row] += stored
+        self.mv_sum_sq[row] += stored * stored
+        self.mv_head[row] = (head + 1) % self.MOVEMENT_HISTORY
+        self.mv_count[row] = min(self.mv_count[row] + 1, self.MOVEMENT_HISTORY)
+    
+    def remove(self, obj_id):
+        """Delete a track by moving the last row into its slot"""
+        row = self.rows.pop(obj_id)
+        last = self.size - 1
+        if row != last:
+            for name in self._fields():
+                values = getattr(self, name)
+                values[row] = values[last]
+            moved_id = self.ids[last]
+            self.ids[row] = moved_id
+            self.rows[moved_id] = row
+        self.ids.pop()
+        self.size -= 1
+
+
 class AnomalyDetector:
     def __init__(self):
         # Track objects across frames
-        self.tracked_objects = defaultdict(lambda: {
-            'positions': deque(maxlen=30),  # Last 30 positions
-            'first_seen': None,
-            'last_seen': None,
-            'stationary_time': 0,
-            'movement_history': deque(maxlen=10),
-            'class': None
-        })
+        self.tracked_objects = TrackTable()
         
         # Track abandoned objects
         self.potential_abandoned_objects = {}
         
+        # Min-heaps of (timestamp, key) so cleanup only visits expiring entries
+        self._expiry_heap = []
+        self._abandoned_heap = []
+        
         # Configuration
         self.loitering_threshold = 10.0  # seconds
         self.abandoned_object_threshold = 5.0  # seconds
         self.movement_threshold = 20  # pixels
+        self.match_distance = 100  # pixels
+        self.person_proximity = 150  # pixels
+        self.abandoned_cell_shift = 5  # abandoned objects are keyed by 32 px grid cell
+        self.match_max_age = 1.0  # seconds
+        self.kdtree_min_tracks = 16  # below this a linear scan is cheaper
         self.fps = 30
+        self.update_distance_thresholds()
+        
+        # Small integer ids for class names so they can be compared in arrays
+        self.class_ids = {}
+        self.class_names = []
+        
+        # Per-frame snapshot of last known track positions used for matching
+        self._track_ids = []
+        self._track_xy = np.empty((0, 2), dtype=np.float64)
+        self._track_cls = np.empty(0, dtype=np.int64)
+        self._track_ts = np.empty(0, dtype=np.float64)
+        self._track_tree = None
         
         # Zone definitions (can be configured)
+        # Zones are {'name': ..., 'bbox': [x, y, w, h]} with an optional 'polygon': [(x, y), ...]
         self.restricted_zones = []
         self.monitoring_zones = []
+        self._zone_boxes = np.empty((0, 4), dtype=np.float64)  # minx, miny, maxx, maxy
+        self._zone_shapes = []
+        self._zone_idx = None
+        self._zone_violations = {}  # object id -> names of zones already reported
+        self._frame_object_ids = []  # object id of each detection in the current frame
+        self._next_object_id = 0  # new tracks are numbered, so ids never collide within a frame
     
     def initialize(self, width, height, fps):
         """Initialize detector with video properties"""
         self.video_width = width
         self.video_height = height
         self.fps = fps
+        self.update_distance_thresholds()
         
         # Define some default monitoring zones
         self.monitoring_zones = [
@@ -40,233 +208,373 @@ class AnomalyDetector:
             {'name': 'center', 'bbox': [width//3, height//3, width//3, height//3]},
             {'name': 'exit', 'bbox': [2*width//3, 2*height//3, width//3, height//3]}
         ]
+        
+        self.build_zone_index()
+    
+    def build_zone_index(self):
+        """Index restricted zone bounding boxes for per-detection lookup"""
+        self._zone_boxes = np.array([
+            [x, y, x + w, y + h] for x, y, w, h in (zone['bbox'] for zone in self.restricted_zones)
+        ], dtype=np.float64).reshape(-1, 4)
+        
+        # Prepared polygons make the exact bbox-polygon intersection test cheap
+        self._zone_shapes = [
+            prep(Polygon(zone['polygon'])) if Polygon is not None and zone.get('polygon') else None
+            for zone in self.restricted_zones
+        ]
+        
+        if rtree_index is not None and self.restricted_zones:
+            self._zone_idx = rtree_index.Index()
+            for i, zone_box in enumerate(self._zone_boxes.tolist()):
+                self._zone_idx.insert(i, zone_box)
+        else:
+            self._zone_idx = None
+    
+    def update_distance_thresholds(self):
+        """Precompute squared distance thresholds so gates can skip the sqrt"""
+        self._match_r2 = self.match_distance ** 2
+        self._person_r2 = self.person_proximity ** 2
+        self._move_r2 = self.movement_threshold ** 2
     
     def detect_anomalies(self, detections, frame_number, timestamp):
-        """Main anomaly detection function"""
+        """Main anomaly detection function
+        
+        detections is the array layout built by to_detection_arrays().
+        """
+        has_detections = len(detections['bbox']) > 0
+        
+        # Quiet frame with nothing tracked: no detector can fire
+        if not has_detections and not len(self.tracked_objects):
+            return _NO_ANOMALIES
+        
         anomalies = []
         
         try:
+            # Compute centers once for all detector passes
+            bbox = detections['bbox']
+            centers = bbox[:, :2] + bbox[:, 2:] // 2
+            classes = detections['class']
+            
             # Update object tracking
-            self.update_tracking(detections, timestamp)
+            self.update_tracking(detections, centers, classes, timestamp)
             
             # Detect loitering
-            loitering_anomalies = self.detect_loitering(timestamp)
-            anomalies.extend(loitering_anomalies)
+            self.detect_loitering(timestamp, anomalies)
             
             # Detect abandoned objects
-            abandoned_anomalies = self.detect_abandoned_objects(detections, timestamp)
-            anomalies.extend(abandoned_anomalies)
+            if has_detections:
+                self.detect_abandoned_objects(detections, centers, classes, timestamp, anomalies)
             
             # Detect suspicious movement patterns
-            movement_anomalies = self.detect_suspicious_movement(timestamp)
-            anomalies.extend(movement_anomalies)
+            self.detect_suspicious_movement(timestamp, anomalies)
             
             # Detect zone violations
-            zone_anomalies = self.detect_zone_violations(detections, timestamp)
-            anomalies.extend(zone_anomalies)
+            if has_detections:
+                self.detect_zone_violations(detections, centers, classes, timestamp, anomalies)
             
         except Exception as e:
             logging.error(f"Error in anomaly detection: {str(e)}")
         
         return anomalies
     
-    def update_tracking(self, detections, timestamp):
+    def update_tracking(self, detections, centers, classes, timestamp):
         """Update object tracking information"""
-        current_objects = set()
+        if not len(centers):
+            self.cleanup_old_objects(timestamp)
+            return
         
-        for detection in detections:
-            # Generate a simple object ID based on position and class
-            center_x = detection['bbox'][0] + detection['bbox'][2] // 2
-            center_y = detection['bbox'][1] + detection['bbox'][3] // 2
-            
+        # Index last known positions once per frame and match all detections at once
+        self.build_track_index()
+        matches = self.match_tracks(centers, classes, timestamp)
+        self._frame_object_ids = []
+        
+        for class_id, (center_x, center_y), match_index in zip(classes.tolist(), centers.tolist(), matches.tolist()):
             # Find closest tracked object or create new one
-            object_id = self.find_or_create_object_id(detection, center_x, center_y, timestamp)
-            current_objects.add(object_id)
+            object_id = self.find_or_create_object_id(class_id, match_index, timestamp)
+            self._frame_object_ids.append(object_id)
             
             # Update tracking info
-            track_info = self.tracked_objects[object_id]
-            track_info['positions'].append((center_x, center_y, timestamp))
-            track_info['last_seen'] = timestamp
-            track_info['class'] = detection['class']
-            
-            if track_info['first_seen'] is None:
-                track_info['first_seen'] = timestamp
+            tracks = self.tracked_objects
+            row = self._get_or_create_track(object_id, class_id, timestamp)
             
             # Calculate movement
-            if len(track_info['positions']) > 1:
-                prev_pos = track_info['positions'][-2]
-                curr_pos = track_info['positions'][-1]
-                distance = math.sqrt((curr_pos[0] - prev_pos[0])**2 + (curr_pos[1] - prev_pos[1])**2)
-                track_info['movement_history'].append(distance)
+            if tracks.pos_count[row] > 0:
+                prev_x, prev_y, prev_ts = tracks.last_x[row], tracks.last_y[row], tracks.last_ts[row]
+                dx, dy = center_x - prev_x, center_y - prev_y
+                distance_sq = dx * dx + dy * dy
+                
+                # The movement history keeps real distances for the variance test
+                tracks.append_movement(row, math.sqrt(distance_sq))
                 
                 # Update stationary time
-                if distance < self.movement_threshold:
-                    time_diff = curr_pos[2] - prev_pos[2]
-                    track_info['stationary_time'] += time_diff
+                if distance_sq < self._move_r2:
+                    tracks.stationary_time[row] += timestamp - prev_ts
                 else:
-                    track_info['stationary_time'] = 0
+                    tracks.stationary_time[row] = 0
+            
+            tracks.append_position(row, center_x, center_y, timestamp)
+            heapq.heappush(self._expiry_heap, (timestamp, object_id))
         
         # Clean up old objects
-        self.cleanup_old_objects(timestamp, current_objects)
+        self.cleanup_old_objects(timestamp)
     
-    def find_or_create_object_id(self, detection, center_x, center_y, timestamp):
+    def _get_or_create_track(self, obj_id, class_id, timestamp):
+        """Get the row of a track, allocating it only when the id is new"""
+        row = self.tracked_objects.rows.get(obj_id)
+        if row is None:
+            row = self.tracked_objects.add(obj_id, class_id, timestamp)
+        return row
+    
+    def class_id(self, class_name):
+        """Get a small integer id for a class name"""
+        class_id = self.class_ids.get(class_name)
+        if class_id is None:
+            class_id = self.class_ids[class_name] = len(self.class_names)
+            self.class_names.append(class_name)
+        return class_id
+    
+    def build_track_index(self):
+        """Snapshot last known track positions and index them for matching"""
+        tracks = self.tracked_objects
+        n = len(tracks)
+        
+        # Rows are only appended during a frame, so snapshot indices stay valid as row indices
+        self._track_ids = list(tracks.ids)
+        self._track_xy = np.column_stack((tracks.last_x[:n], tracks.last_y[:n]))
+        self._track_cls = tracks.class_id[:n].copy()
+        self._track_ts = tracks.last_ts[:n].copy()
+        
+        if cKDTree is not None and n >= self.kdtree_min_tracks:
+            self._track_tree = cKDTree(self._track_xy)
+        else:
+            self._track_tree = None
+    
+    def match_tracks(self, centers, classes, timestamp):
+        """Find the snapshot index of the closest recent track for each detection"""
+        matches = np.full(len(centers), -1, dtype=np.int64)
+        if not len(centers) or not self._track_ids:
+            return matches
+        
+        det_xy = centers.astype(np.float64)
+        det_cls = classes.astype(np.int64)
+        r2 = float(self._match_r2)
+        claimed = np.zeros(len(self._track_ids), dtype=np.bool_)
+        
+        if self._track_tree is None:
+            return _match_gate(det_xy, det_cls, self._track_xy, self._track_cls,
+                               self._track_ts, timestamp, r2, self.match_max_age, claimed)
+        
+        # Only gate tracks inside the matching radius when the index is available
+        neighbours = self._track_tree.query_ball_point(det_xy, r=self.match_distance)
+        for i, candidates in enumerate(neighbours):
+            if not candidates:
+                continue
+            candidates = np.sort(np.asarray(candidates, dtype=np.int64))
+            best = _match_gate(det_xy[i:i + 1], det_cls[i:i + 1], self._track_xy[candidates],
+                               self._track_cls[candidates], self._track_ts[candidates],
+                               timestamp, r2, self.match_max_age, claimed[candidates])[0]
+            if best >= 0:
+                matches[i] = candidates[best]
+                claimed[candidates[best]] = True
+        
+        return matches
+    
+    def find_or_create_object_id(self, class_id, match_index, timestamp):
         """Find existing object or create new ID"""
-        min_distance = float('inf')
-        best_match = None
-        
-        # Look for nearby objects of the same class
-        for obj_id, track_info in self.tracked_objects.items():
-            if track_info['class'] == detection['class'] and track_info['positions']:
-                last_pos = track_info['positions'][-1]
-                distance = math.sqrt((center_x - last_pos[0])**2 + (center_y - last_pos[1])**2)
-                
-                # Check if object was seen recently and is close enough
-                time_diff = timestamp - last_pos[2]
-                if distance < 100 and time_diff < 1.0 and distance < min_distance:
-                    min_distance = distance
-                    best_match = obj_id
-        
-        if best_match:
-            return best_match
+        if match_index >= 0:
+            return self._track_ids[match_index]
         else:
             # Create new object ID
-            return f"{detection['class']}_{int(timestamp*1000)}"
+            object_id = f"{self.class_names[class_id]}_{self._next_object_id}"
+            self._next_object_id += 1
+            return object_id
     
-    def detect_loitering(self, timestamp):
+    def detect_loitering(self, timestamp, anomalies):
         """Detect people loitering in areas"""
-        anomalies = []
-        
-        for obj_id, track_info in self.tracked_objects.items():
-            if track_info['class'] == 'person' and track_info['stationary_time'] > self.loitering_threshold:
-                if track_info['positions']:
-                    last_pos = track_info['positions'][-1]
-                    
-                    anomalies.append({
-                        'type': 'loitering',
-                        'description': f'Person loitering for {track_info["stationary_time"]:.1f} seconds',
-                        'severity': 'medium' if track_info['stationary_time'] < 30 else 'high',
-                        'start_frame': 0,  # Would need to calculate from timestamp
-                        'start_timestamp': track_info['first_seen'],
-                        'bbox': self.get_object_bbox(obj_id),
-                        'confidence': 0.8,
-                        'object_id': obj_id
-                    })
+        tracks = self.tracked_objects
+        n = len(tracks)
         
-        return anomalies
+        loitering = (tracks.class_id[:n] == self.class_id('person')) & (tracks.stationary_time[:n] > self.loitering_threshold)
+        for row in np.nonzero(loitering)[0]:
+            stationary_time = float(tracks.stationary_time[row])
+            obj_id = tracks.ids[row]
+            
+            anomalies.append({
+                'type': 'loitering',
+                'description': f'Person loitering for {stationary_time:.1f} seconds',
+                'severity': 'medium' if stationary_time < 30 else 'high',
+                'start_frame': 0,  # Would need to calculate from timestamp
+                'start_timestamp': float(tracks.first_seen[row]),
+                'bbox': self.get_object_bbox(obj_id),
+                'confidence': 0.8,
+                'object_id': obj_id
+            })
     
-    def detect_abandoned_objects(self, detections, timestamp):
+    def detect_abandoned_objects(self, detections, centers, classes, timestamp, anomalies):
         """Detect objects that appear without associated person"""
-        anomalies = []
         
         # Look for objects that are not persons
-        for detection in detections:
-            if detection['class'] not in ['person']:
-                center_x = detection['bbox'][0] + detection['bbox'][2] // 2
-                center_y = detection['bbox'][1] + detection['bbox'][3] // 2
-                
-                # Check if there's a person nearby
-                person_nearby = False
-                for other_detection in detections:
-                    if other_detection['class'] == 'person':
-                        other_center_x = other_detection['bbox'][0] + other_detection['bbox'][2] // 2
-                        other_center_y = other_detection['bbox'][1] + other_detection['bbox'][3] // 2
-                        distance = math.sqrt((center_x - other_center_x)**2 + (center_y - other_center_y)**2)
-                        
-                        if distance < 150:  # Person within 150 pixels
-                            person_nearby = True
-                            break
-                
-                if not person_nearby:
-                    object_key = f"{detection['class']}_{center_x}_{center_y}"
-                    
-                    if object_key not in self.potential_abandoned_objects:
-                        self.potential_abandoned_objects[object_key] = {
-                            'first_seen': timestamp,
-                            'detection': detection,
-                            'confirmed': False
-                        }
-                    else:
-                        abandoned_info = self.potential_abandoned_objects[object_key]
-                        time_abandoned = timestamp - abandoned_info['first_seen']
-                        
-                        if time_abandoned > self.abandoned_object_threshold and not abandoned_info['confirmed']:
-                            anomalies.append({
-                                'type': 'abandoned_object',
-                                'description': f'Abandoned {detection["class"]} detected for {time_abandoned:.1f} seconds',
-                                'severity': 'high',
-                                'start_frame': 0,
-                                'start_timestamp': abandoned_info['first_seen'],
-                                'bbox': detection['bbox'],
-                                'confidence': 0.9,
-                                'object_id': object_key
-                            })
-                            abandoned_info['confirmed'] = True
+        is_person = classes == self.class_id('person')
+        others = np.nonzero(~is_person)[0]
+        if not len(others):
+            return
         
-        return anomalies
-    
-    def detect_suspicious_movement(self, timestamp):
-        """Detect suspicious movement patterns"""
-        anomalies = []
+        other_xy = centers[others]
+        
+        # Check if there's a person nearby (within 150 pixels) for all objects at once
+        if is_person.any():
+            person_xy = centers[is_person]
+            distance_sq = _pairwise_sqdist(other_xy, person_xy)
+            has_person = (distance_sq < self._person_r2).any(axis=1)
+        else:
+            has_person = np.zeros(len(others), dtype=bool)
         
-        for obj_id, track_info in self.tracked_objects.items():
-            if track_info['class'] == 'person' and len(track_info['movement_history']) > 5:
-                # Calculate average movement speed
-                avg_movement = sum(track_info['movement_history']) / len(track_info['movement_history'])
+        for i, (center_x, center_y), person_nearby in zip(others.tolist(), other_xy.tolist(), has_person.tolist()):
+            if not person_nearby:
+                class_name = self.class_names[classes[i]]
+                object_key = self.find_abandoned_object_key(class_name, center_x, center_y)
                 
-                # Detect erratic movement (high variance in movement)
-                if len(track_info['movement_history']) > 8:
-                    movement_variance = sum((x - avg_movement)**2 for x in track_info['movement_history']) / len(track_info['movement_history'])
+                if object_key not in self.potential_abandoned_objects:
+                    self.potential_abandoned_objects[object_key] = {
+                        'first_seen': timestamp,
+                        'bbox': detections['bbox'][i].tolist(),
+                        'confirmed': False
+                    }
+                    heapq.heappush(self._abandoned_heap, (timestamp, object_key))
+                else:
+                    abandoned_info = self.potential_abandoned_objects[object_key]
+                    time_abandoned = timestamp - abandoned_info['first_seen']
                     
-                    if movement_variance > 1000:  # High variance threshold
+                    if time_abandoned > self.abandoned_object_threshold and not abandoned_info['confirmed']:
                         anomalies.append({
-                            'type': 'suspicious_movement',
-                            'description': f'Erratic movement pattern detected',
-                            'severity': 'medium',
+                            'type': 'abandoned_object',
+                            'description': f'Abandoned {class_name} detected for {time_abandoned:.1f} seconds',
+                            'severity': 'high',
                             'start_frame': 0,
-                            'start_timestamp': track_info['first_seen'],
-                            'bbox': self.get_object_bbox(obj_id),
-                            'confidence': 0.7,
-                            'object_id': obj_id
+                            'start_timestamp': abandoned_info['first_seen'],
+                            'bbox': detections['bbox'][i].tolist(),
+                            'confidence': 0.9,
+                            'object_id': '_'.join(str(part) for part in object_key)
                         })
+                        abandoned_info['confirmed'] = True
+    
+    def find_abandoned_object_key(self, class_name, center_x, center_y):
+        """Get the grid cell key of an abandoned object candidate"""
+        cell_x = center_x >> self.abandoned_cell_shift
+        cell_y = center_y >> self.abandoned_cell_shift
+        object_key = (class_name, cell_x, cell_y)
+        if object_key in self.potential_abandoned_objects:
+            return object_key
         
-        return anomalies
+        # An object jittering across a cell border keeps its earlier sighting
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbour_key = (class_name, cell_x + dx, cell_y + dy)
+                if neighbour_key in self.potential_abandoned_objects:
+                    return neighbour_key
+        
+        return object_key
     
-    def detect_zone_violations(self, detections, timestamp):
-        """Detect violations in restricted zones"""
-        anomalies = []
+    def detect_suspicious_movement(self, timestamp, anomalies):
+        """Detect suspicious movement patterns"""
+        tracks = self.tracked_objects
+        n = len(tracks)
         
-        # This would be implemented based on specific zone definitions
-        # For now, we'll implement a simple version
+        # Variance of the movement history of every track from its running sums
+        count = tracks.mv_count[:n]
+        safe_count = np.maximum(count, 1)
+        mean = tracks.mv_sum[:n] / safe_count
+        movement_variance = tracks.mv_sum_sq[:n] / safe_count - mean * mean
         
-        return anomalies
+        # Detect erratic movement (high variance in movement)
+        erratic = (tracks.class_id[:n] == self.class_id('person')) & (count > 8) & (movement_variance > 1000)
+        for row in np.nonzero(erratic)[0]:
+            obj_id = tracks.ids[row]
+            anomalies.append({
+                'type': 'suspicious_movement',
+                'description': f'Erratic movement pattern detected',
+                'severity': 'medium',
+                'start_frame': 0,
+                'start_timestamp': float(tracks.first_seen[row]),
+                'bbox': self.get_object_bbox(obj_id),
+                'confidence': 0.7,
+                'object_id': obj_id
+            })
+    
+    def detect_zone_violations(self, detections, centers, classes, timestamp, anomalies):
+        """Detect violations in restricted zones"""
+        if not self.restricted_zones:
+            return
+        
+        for i in np.nonzero(classes == self.class_id('person'))[0]:
+            x, y, w, h = detections['bbox'][i].tolist()
+            det_box = (x, y, x + w, y + h)
+            
+            # Only zones whose bounding box overlaps the detection need an exact test
+            if self._zone_idx is not None:
+                zone_ids = self._zone_idx.intersection(det_box)
+            else:
+                zones = self._zone_boxes
+                zone_ids = np.nonzero((zones[:, 0] <= det_box[2]) & (zones[:, 2] >= det_box[0]) &
+                                      (zones[:, 1] <= det_box[3]) & (zones[:, 3] >= det_box[1]))[0].tolist()
+            
+            obj_id = self._frame_object_ids[i]
+            reported = self._zone_violations.setdefault(obj_id, set())
+            for zone_id in zone_ids:
+                zone = self.restricted_zones[zone_id]
+                shape = self._zone_shapes[zone_id]
+                if zone['name'] in reported or (shape is not None and not shape.intersects(box(*det_box))):
+                    continue
+                
+                reported.add(zone['name'])
+                anomalies.append({
+                    'type': 'zone_violation',
+                    'description': f'Person entered restricted zone "{zone["name"]}"',
+                    'severity': 'high',
+                    'start_frame': 0,
+                    'start_timestamp': timestamp,
+                    'bbox': [x, y, w, h],
+                    'confidence': 0.85,
+                    'object_id': obj_id
+                })
+    
+    def set_class_names(self, class_names):
+        """Adopt the detector's class table so its class ids can be used directly"""
+        self.class_names = list(class_names)
+        self.class_ids = {name: i for i, name in enumerate(self.class_names)}
+    
+    def to_detection_arrays(self, detections):
+        """Split a DET_DTYPE structured array into the (N, ...) layout used by detect_anomalies"""
+        return {
+            'bbox': np.stack((detections['x'], detections['y'], detections['w'], detections['h']), axis=1),
+            'class': detections['class_id'],
+            'confidence': detections['conf']
+        }
     
     def get_object_bbox(self, obj_id):
         """Get current bounding box for tracked object"""
-        track_info = self.tracked_objects[obj_id]
-        if track_info['positions']:
-            last_pos = track_info['positions'][-1]
+        tracks = self.tracked_objects
+        row = tracks.rows.get(obj_id)
+        if row is not None and tracks.pos_count[row] > 0:
             # Return a default bbox around the last known position
-            return [last_pos[0] - 25, last_pos[1] - 25, 50, 50]
+            return [int(tracks.last_x[row]) - 25, int(tracks.last_y[row]) - 25, 50, 50]
         return [0, 0, 50, 50]
     
-    def cleanup_old_objects(self, timestamp, current_objects):
+    def cleanup_old_objects(self, timestamp):
         """Remove objects that haven't been seen recently"""
-        to_remove = []
-        
-        for obj_id, track_info in self.tracked_objects.items():
-            if obj_id not in current_objects and track_info['last_seen']:
-                time_since_seen = timestamp - track_info['last_seen']
-                if time_since_seen > 5.0:  # Remove after 5 seconds
-                    to_remove.append(obj_id)
-        
-        for obj_id in to_remove:
-            del self.tracked_objects[obj_id]
+        tracks = self.tracked_objects
         
-        # Clean up abandoned objects too
-        to_remove_abandoned = []
-        for obj_key, info in self.potential_abandoned_objects.items():
-            if timestamp - info['first_seen'] > 60:  # Remove after 1 minute
-                to_remove_abandoned.append(obj_key)
+        # Remove after 5 seconds; entries older than a track's last sighting are stale
+        while self._expiry_heap and self._expiry_heap[0][0] < timestamp - 5.0:
+            last_seen, obj_id = heapq.heappop(self._expiry_heap)
+            row = tracks.rows.get(obj_id)
+            if row is not None and tracks.last_ts[row] == last_seen:
+                tracks.remove(obj_id)
+                self._zone_violations.pop(obj_id, None)
         
-        for obj_key in to_remove_abandoned:
-            del self.potential_abandoned_objects[obj_key]
+        # Clean up abandoned objects too (remove after 1 minute)
+        while self._abandoned_heap and self._abandoned_heap[0][0] < timestamp - 60:
+            first_seen, obj_key = heapq.heappop(self._abandoned_heap)
+            info = self.potential_abandoned_objects.get(obj_key)
+            if info is not None and info['first_seen'] == first_seen:
+                del self.potential_abandoned_objects[obj_key]
@@ -1,7 +1,10 @@
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
+import sqlalchemy as sa
 from flask import Flask
+from sqlalchemy.engine import make_url
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from extensions import db         # Import db here, NOT from models
@@ -16,20 +19,76 @@ app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:/
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
+    "insertmanyvalues_page_size": 5000,  # rows per multi-row INSERT for the processor's bulk inserts
 }
+if make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_driver_name() == "psycopg2":
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["executemany_mode"] = "values_plus_batch"
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["executemany_batch_page_size"] = 500  # rows per execute_batch call for non-INSERT executemany
 
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['PROCESSED_FOLDER'] = 'processed'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024 # 500MB
+app.config['VIDEO_ACCEL_REDIRECT'] = os.environ.get('VIDEO_ACCEL_REDIRECT')  # nginx internal location prefix, if any
+app.config['PROCESSOR_WORKERS'] = int(os.environ.get('PROCESSOR_WORKERS', 2))
+app.config['PROCESSOR_QUEUE_LIMIT'] = int(os.environ.get('PROCESSOR_QUEUE_LIMIT', 10))  # queued videos before uploads get a 429
+app.config['ANALYSIS_FPS'] = float(os.environ.get('ANALYSIS_FPS', 0))  # frames per second sampled for detection, 0 = every frame (anomaly pixel thresholds assume every frame)
+app.config['DECODE_WORKERS'] = int(os.environ.get('DECODE_WORKERS', 0))  # >1 runs detection on GOP chunks in worker processes (needs PyAV)
+app.config['INSERT_BATCH_FRAMES'] = int(os.environ.get('INSERT_BATCH_FRAMES', 500))  # frames of rows buffered per bulk insert
+app.config['PROGRESS_INTERVAL'] = float(os.environ.get('PROGRESS_INTERVAL', 5.0))  # seconds between processed_frames writes
+app.config['SKIP_EMPTY_FRAMES'] = os.environ.get('SKIP_EMPTY_FRAMES', '').lower() in ('1', 'true', 'yes')  # drop quiet frames from the output video, shortening it
+app.config['ANALYSIS_RESOLUTION'] = int(os.environ.get('ANALYSIS_RESOLUTION', 416))  # YOLO input side in pixels, a multiple of 32
+app.config['DETECTION_BATCH_SIZE'] = int(os.environ.get('DETECTION_BATCH_SIZE', 8))  # sampled frames per YOLO forward pass
+app.config['USE_OPENCL'] = os.environ.get('USE_OPENCL', '').lower() in ('1', 'true', 'yes')  # resize frames on an OpenCL device when one is present
+app.config['HW_VIDEO_ACCELERATION'] = os.environ.get('HW_VIDEO_ACCELERATION', '1').lower() in ('1', 'true', 'yes')  # ask FFmpeg for NVDEC/VAAPI/QSV decode and encode
+
+# Bounded pool for background video processing
+app.processor_pool = ThreadPoolExecutor(max_workers=app.config['PROCESSOR_WORKERS'],
+                                        thread_name_prefix='video-processor')
 
 db.init_app(app)
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['PROCESSED_FOLDER'], exist_ok=True)
 
+def upgrade_object_id_column(table):
+    """Convert a detected_object.object_id column created as VARCHAR to BIGINT"""
+    column = next(c for c in sa.inspect(db.engine).get_columns(table.name) if c['name'] == 'object_id')
+    if isinstance(column['type'], sa.Integer):
+        return
+    
+    logging.info(f"Converting {table.name}.object_id to BIGINT")
+    # Old string ids ("person_1697...") have no integer form and become NULL
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(sa.text(
+                f"ALTER TABLE {table.name} ALTER COLUMN object_id TYPE BIGINT "
+                f"USING CASE WHEN object_id ~ '^[0-9]+$' THEN object_id::bigint END"
+            ))
+        else:
+            # SQLite cannot change a column type in place, so copy into a freshly created table
+            old_name = f"{table.name}_old"
+            conn.execute(sa.text(f"ALTER TABLE {table.name} RENAME TO {old_name}"))
+            for index in sa.inspect(conn).get_indexes(old_name):
+                conn.execute(sa.text(f"DROP INDEX {index['name']}"))
+            table.create(bind=conn)
+            
+            columns = [c.name for c in table.columns if c.name != 'object_id']
+            conn.execute(sa.text(
+                f"INSERT INTO {table.name} ({', '.join(columns)}, object_id) "
+                f"SELECT {', '.join(columns)}, CASE WHEN object_id <> '' AND object_id NOT GLOB '*[^0-9]*' "
+                f"THEN CAST(object_id AS INTEGER) END FROM {old_name}"
+            ))
+            conn.execute(sa.text(f"DROP TABLE {old_name}"))
+
 with app.app_context():
     from models import VideoAnalysis, DetectedObject, Anomaly, Alert  # Safe now
     db.create_all()
+    upgrade_object_id_column(DetectedObject.__table__)
+    
+    # create_all skips tables that already exist, so add any indexes they are missing
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
 
     from routes import *
 
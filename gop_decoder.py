@@ -0,0 +1,71 @@
+# gop_decoder.py
+import bisect
+import logging
+
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:  # PyAV is optional, videos are then decoded serially with OpenCV
+    av = None
+    AV_AVAILABLE = False
+
+from yolo_detector import get_detector
+
+
+def decode_chunks(path, c):
+    """Split the video into c keyframe-aligned (start_pts, end_pts, first_frame) intervals"""
+    pts = []
+    keyframes = []
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        # Demuxing only reads packets, nothing is decoded here
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            pts.append(packet.pts)
+            if packet.is_keyframe:
+                keyframes.append(packet.pts)
+    
+    if not keyframes:
+        return []
+    
+    pts.sort()
+    keyframes.sort()
+    c = max(1, min(c, len(keyframes)))
+    starts = [keyframes[i * len(keyframes) // c] for i in range(c)]
+    
+    # Frames are numbered in presentation order like the parent's capture, so a chunk's first
+    # frame number is the count of frames shown before its keyframe; this holds on VFR files too
+    first_frames = [bisect.bisect_left(pts, start) for start in starts]
+    return list(zip(starts, starts[1:] + [None], first_frames))
+
+
+def detect_chunk(path, start_pts, end_pts, first_frame, stride):
+    """Decode one interval and return (frame_number, detections) for every stride-th frame"""
+    results = []
+    
+    try:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            frame_number = first_frame
+            container.seek(start_pts, stream=stream)
+            
+            # Each chunk learns its own fallback background from its first frames
+            bg_subtractor = get_detector().create_background_model()
+            
+            for frame in container.decode(stream):
+                if frame.pts is None or frame.pts < start_pts:
+                    continue
+                if end_pts is not None and frame.pts >= end_pts:
+                    break
+                
+                if frame_number % stride == 0:
+                    detections = get_detector().detect(frame.to_ndarray(format='bgr24'), bg_subtractor)
+                    results.append((frame_number, detections))
+                frame_number += 1
+    
+    except Exception as e:
+        logging.error(f"Error decoding chunk {start_pts}-{end_pts} of {path}: {str(e)}")
+        raise
+    
+    return results
@@ -0,0 +1,16 @@
+# jit.py
+import logging
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba is optional, kernels then run as plain NumPy code
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+    logging.debug("numba not installed, JIT kernels will run uncompiled")
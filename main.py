@@ -1,4 +1,6 @@
-from app import app
+# Spawned GOP workers re-import this file as __mp_main__; they only need the detector, not the app
+if __name__ != '__mp_main__':
+    from app import app
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
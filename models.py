@@ -3,6 +3,11 @@ from datetime import datetime
 from sqlalchemy import Text, DateTime, Float, Integer, String, Boolean
 
 class VideoAnalysis(db.Model):
+    __table_args__ = (
+        db.Index('ix_videoanalysis_upload_time', 'upload_time'),
+        db.Index('ix_videoanalysis_status', 'processing_status'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(255), nullable=False)
     upload_time = db.Column(db.DateTime, default=datetime.utcnow)
@@ -23,6 +28,10 @@ class VideoAnalysis(db.Model):
     pass
 
 class DetectedObject(db.Model):
+    __table_args__ = (
+        db.Index('ix_detectedobject_vid_class', 'video_analysis_id', 'class_name'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     video_analysis_id = db.Column(db.Integer, db.ForeignKey('video_analysis.id'), nullable=False)
     frame_number = db.Column(db.Integer, nullable=False)
@@ -33,15 +42,20 @@ class DetectedObject(db.Model):
     bbox_y = db.Column(db.Float, nullable=False)
     bbox_width = db.Column(db.Float, nullable=False)
     bbox_height = db.Column(db.Float, nullable=False)
-    object_id = db.Column(db.String(100))  # For tracking across frames
+    object_id = db.Column(db.BigInteger)  # Tracker id, or (frame_number << 16) | detection index
     
     def __repr__(self):
         return f'<DetectedObject {self.class_name} at frame {self.frame_number}>'
     pass
 class Anomaly(db.Model):
+    __table_args__ = (
+        db.Index('ix_anomaly_vid_ts', 'video_analysis_id', 'start_timestamp'),
+        db.Index('ix_anomaly_detected_date', 'detected_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     video_analysis_id = db.Column(db.Integer, db.ForeignKey('video_analysis.id'), nullable=False)
-    anomaly_type = db.Column(db.String(100), nullable=False)  # loitering, abandoned_object, suspicious_movement
+    anomaly_type = db.Column(db.String(100), nullable=False)  # loitering, abandoned_object, suspicious_movement, zone_violation
     description = db.Column(db.Text)
     severity = db.Column(db.String(20), default='medium')  # low, medium, high, critical
     start_frame = db.Column(db.Integer, nullable=False)
@@ -56,10 +70,17 @@ class Anomaly(db.Model):
     detected_time = db.Column(db.DateTime, default=datetime.utcnow)
     is_resolved = db.Column(db.Boolean, default=False)
     
+    video_analysis = db.relationship('VideoAnalysis', backref='anomalies')
+    
     def __repr__(self):
         return f'<Anomaly {self.anomaly_type} at {self.start_timestamp}s>'
     pass
 class Alert(db.Model):
+    __table_args__ = (
+        db.Index('ix_alert_anomaly_created', 'anomaly_id', 'created_time'),
+        db.Index('ix_alert_created_time', 'created_time'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     anomaly_id = db.Column(db.Integer, db.ForeignKey('anomaly.id'), nullable=False)
     alert_level = db.Column(db.String(20), default='warning')  # info, warning, danger, critical
@@ -69,6 +90,8 @@ class Alert(db.Model):
     acknowledged_by = db.Column(db.String(100))
     acknowledged_time = db.Column(db.DateTime)
     
+    anomaly = db.relationship('Anomaly', backref='alerts')
+    
     def __repr__(self):
         return f'<Alert {self.alert_level} - {self.message[:50]}>'
     pass
@@ -1,18 +1,23 @@
 import os
+import re
 import json
+import time
 import logging
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, abort
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from sqlalchemy.orm import contains_eager
 from app import app, db
 from models import VideoAnalysis, DetectedObject, Anomaly, Alert
-from video_processor import VideoProcessor
-import threading
+from video_processor import live_progress, queued_jobs, submit_analysis
 from datetime import datetime
 
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'mkv', 'flv', 'wmv'}
+_EXT_RE = re.compile(r'\.(%s)\Z' % '|'.join(sorted(ALLOWED_EXTENSIONS)), re.IGNORECASE)
+_UPLOAD_PREFIX_FORMAT = '%Y%m%d_%H%M%S_'
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return bool(_EXT_RE.search(filename))
 
 @app.route('/')
 def index():
@@ -55,10 +60,14 @@ def upload_video():
         flash('No file selected', 'error')
         return redirect(request.url)
     
+    if queued_jobs() >= app.config['PROCESSOR_QUEUE_LIMIT']:
+        flash('Too many videos are waiting to be processed. Please try again later.', 'error')
+        return render_template('upload.html'), 429
+    
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         # Add timestamp to avoid conflicts
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
+        timestamp = time.strftime(_UPLOAD_PREFIX_FORMAT)
         filename = timestamp + filename
         
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -73,11 +82,8 @@ def upload_video():
         db.session.add(analysis)
         db.session.commit()
         
-        # Start processing in background thread
-        processor = VideoProcessor()
-        thread = threading.Thread(target=processor.process_video, args=(analysis.id,))
-        thread.daemon = True
-        thread.start()
+        # Queue processing on the background worker pool
+        submit_analysis(analysis.id)
         
         flash(f'Video "{file.filename}" uploaded successfully and processing started!', 'success')
         return redirect(url_for('dashboard'))
@@ -89,7 +95,7 @@ def upload_video():
 def dashboard():
     """Main surveillance dashboard"""
     analyses = VideoAnalysis.query.order_by(VideoAnalysis.upload_time.desc()).all()
-    return render_template('dashboard.html', analyses=analyses)
+    return render_template('dashboard.html', analyses=analyses, queued_videos=queued_jobs())
 
 @app.route('/analysis/<int:analysis_id>')
 def analysis_detail(analysis_id):
@@ -107,17 +113,22 @@ def analysis_detail(analysis_id):
 def get_analysis_status(analysis_id):
     """API endpoint to get analysis status"""
     analysis = VideoAnalysis.query.get_or_404(analysis_id)
+    # Videos processed by this worker report live progress, others fall back to the stored count
+    processed_frames = live_progress.get(analysis_id, analysis.processed_frames)
     return jsonify({
         'status': analysis.processing_status,
-        'processed_frames': analysis.processed_frames,
+        'processed_frames': processed_frames,
         'total_frames': analysis.total_frames,
-        'progress': (analysis.processed_frames / analysis.total_frames * 100) if analysis.total_frames else 0
+        'progress': (processed_frames / analysis.total_frames * 100) if analysis.total_frames else 0
     })
 
 @app.route('/api/alerts')
 def get_alerts():
     """API endpoint to get recent alerts"""
-    alerts = Alert.query.join(Anomaly).join(VideoAnalysis).order_by(Alert.created_time.desc()).limit(20).all()
+    # Load each alert's anomaly and video in the same query
+    alerts = Alert.query.join(Anomaly).join(VideoAnalysis).options(
+        contains_eager(Alert.anomaly).contains_eager(Anomaly.video_analysis)
+    ).order_by(Alert.created_time.desc()).limit(20).all()
     
     alert_data = []
     for alert in alerts:
@@ -127,8 +138,8 @@ def get_alerts():
             'message': alert.message,
             'created_time': alert.created_time.isoformat(),
             'is_acknowledged': alert.is_acknowledged,
-            'anomaly_type': alert.anomaly_id and Anomaly.query.get(alert.anomaly_id).anomaly_type,
-            'video_filename': alert.anomaly_id and Anomaly.query.get(alert.anomaly_id).video_analysis_id and VideoAnalysis.query.get(Anomaly.query.get(alert.anomaly_id).video_analysis_id).filename
+            'anomaly_type': alert.anomaly.anomaly_type,
+            'video_filename': alert.anomaly.video_analysis.filename
         })
     
     return jsonify(alert_data)
@@ -155,19 +166,30 @@ def resolve_anomaly(anomaly_id):
     
     return jsonify({'success': True})
 
+def send_video(folder, filename):
+    """Send a video file with Range/ETag support, or hand it to nginx when configured"""
+    path = safe_join(os.path.join(app.root_path, folder), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    # Let nginx do the (zero-copy) transfer from an internal location
+    accel_prefix = app.config.get('VIDEO_ACCEL_REDIRECT')
+    if accel_prefix:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{folder}/{filename}"
+        return response
+    
+    return send_file(path, conditional=True, etag=True, last_modified=os.path.getmtime(path))
+
 @app.route('/video/<path:filename>')
 def serve_video(filename):
     """Serve video files"""
-    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-    response.headers['Accept-Ranges'] = 'bytes'
-    return response
+    return send_video(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/processed/<path:filename>')
 def serve_processed_video(filename):
     """Serve processed video files with annotations"""
-    response = send_from_directory(app.config['PROCESSED_FOLDER'], filename)
-    response.headers['Accept-Ranges'] = 'bytes'
-    return response
+    return send_video(app.config['PROCESSED_FOLDER'], filename)
 
 @app.route('/api/analysis/<int:analysis_id>', methods=['DELETE'])
 def delete_analysis(analysis_id):
@@ -175,12 +197,9 @@ def delete_analysis(analysis_id):
     try:
         analysis = VideoAnalysis.query.get_or_404(analysis_id)
         
-        # First, get all anomaly IDs for this analysis
-        anomaly_ids = [anomaly.id for anomaly in Anomaly.query.filter_by(video_analysis_id=analysis_id).all()]
-        
-        # Delete related alerts using the anomaly IDs
-        if anomaly_ids:
-            Alert.query.filter(Alert.anomaly_id.in_(anomaly_ids)).delete(synchronize_session=False)
+        # Delete related alerts in one statement, selecting the anomaly IDs in SQL
+        anomaly_ids = db.session.query(Anomaly.id).filter_by(video_analysis_id=analysis_id)
+        Alert.query.filter(Alert.anomaly_id.in_(anomaly_ids.scalar_subquery())).delete(synchronize_session=False)
         
         # Delete anomalies
         Anomaly.query.filter_by(video_analysis_id=analysis_id).delete()
@@ -218,16 +237,32 @@ def get_statistics():
     from sqlalchemy import func, desc
     from datetime import datetime, timedelta
     
-    # Basic stats
+    # Basic stats, one grouped count per table
+    video_status_counts = dict(db.session.query(
+        VideoAnalysis.processing_status,
+        func.count(VideoAnalysis.id)
+    ).group_by(VideoAnalysis.processing_status).all())
+    
+    anomaly_resolved_counts = dict(db.session.query(
+        Anomaly.is_resolved,
+        func.count(Anomaly.id)
+    ).group_by(Anomaly.is_resolved).all())
+    
+    alert_acknowledged_counts = dict(db.session.query(
+        Alert.is_acknowledged,
+        func.count(Alert.id)
+    ).group_by(Alert.is_acknowledged).all())
+    
     stats = {
-        'total_videos': VideoAnalysis.query.count(),
-        'processing_videos': VideoAnalysis.query.filter_by(processing_status='processing').count(),
-        'completed_videos': VideoAnalysis.query.filter_by(processing_status='completed').count(),
-        'failed_videos': VideoAnalysis.query.filter_by(processing_status='failed').count(),
-        'total_anomalies': Anomaly.query.count(),
-        'unresolved_anomalies': Anomaly.query.filter_by(is_resolved=False).count(),
-        'total_alerts': Alert.query.count(),
-        'unacknowledged_alerts': Alert.query.filter_by(is_acknowledged=False).count(),
+        'total_videos': sum(video_status_counts.values()),
+        'processing_videos': video_status_counts.get('processing', 0),
+        'completed_videos': video_status_counts.get('completed', 0),
+        'failed_videos': video_status_counts.get('failed', 0),
+        'total_anomalies': sum(anomaly_resolved_counts.values()),
+        'unresolved_anomalies': anomaly_resolved_counts.get(False, 0),
+        'total_alerts': sum(alert_acknowledged_counts.values()),
+        'unacknowledged_alerts': alert_acknowledged_counts.get(False, 0),
+        'queued_videos': queued_jobs(),
         'anomaly_types': {}
     }
     
@@ -243,6 +278,19 @@ def get_statistics():
     # Get daily data for the last 7 days
     end_date = datetime.now()
     start_date = end_date - timedelta(days=6)  # Last 7 days including today
+    start_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    # Count videos and anomalies per day in one query each
+    # (SQLite returns the day as a string, PostgreSQL as a date)
+    video_day = func.date(VideoAnalysis.upload_time)
+    videos_by_day = {str(day): count for day, count in db.session.query(
+        video_day, func.count(VideoAnalysis.id)
+    ).filter(VideoAnalysis.upload_time >= start_day).group_by(video_day).all()}
+    
+    anomaly_day = func.date(Anomaly.detected_time)
+    anomalies_by_day = {str(day): count for day, count in db.session.query(
+        anomaly_day, func.count(Anomaly.id)
+    ).filter(Anomaly.detected_time >= start_day).group_by(anomaly_day).all()}
     
     # Initialize daily data
     daily_videos = []
@@ -253,17 +301,9 @@ def get_statistics():
         current_date = start_date + timedelta(days=i)
         daily_labels.append(current_date.strftime('%a'))  # Mon, Tue, etc.
         
-        # Count videos uploaded on this day
-        video_count = VideoAnalysis.query.filter(
-            func.date(VideoAnalysis.upload_time) == current_date.date()
-        ).count()
-        daily_videos.append(video_count)
-        
-        # Count anomalies detected on this day
-        anomaly_count = Anomaly.query.filter(
-            func.date(Anomaly.detected_time) == current_date.date()
-        ).count()
-        daily_anomalies.append(anomaly_count)
+        day_key = current_date.date().isoformat()
+        daily_videos.append(videos_by_day.get(day_key, 0))
+        daily_anomalies.append(anomalies_by_day.get(day_key, 0))
     
     # Add daily data to stats
     stats['daily_videos'] = daily_videos
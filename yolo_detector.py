@@ -2,16 +2,91 @@ import cv2
 import numpy as np
 import logging
 import os
+import threading
 import urllib.request
 
+from jit import njit
+
+# One row per detection, passed through the whole pipeline instead of per-box dicts
+DET_DTYPE = np.dtype([('class_id', 'i4'), ('conf', 'f4'), ('x', 'i4'), ('y', 'i4'),
+                      ('w', 'i4'), ('h', 'i4'), ('track_id', 'i4')])  # track_id -1 = untracked
+
+def cuda_available():
+    """Check whether OpenCV can run DNN inference on a CUDA device"""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+def opencl_available():
+    """Check whether OpenCV can run UMat operations on an OpenCL device"""
+    try:
+        return cv2.ocl.haveOpenCL()
+    except (AttributeError, cv2.error):
+        return False
+
+@njit(cache=True, fastmath=True)
+def _decode_boxes(rows, width, height):
+    """Convert normalized center/size rows to integer x, y, w, h boxes"""
+    center_x = (rows[:, 0] * width).astype(np.int32)
+    center_y = (rows[:, 1] * height).astype(np.int32)
+    w = (rows[:, 2] * width).astype(np.int32)
+    h = (rows[:, 3] * height).astype(np.int32)
+    
+    boxes = np.empty((rows.shape[0], 4), dtype=np.int32)
+    boxes[:, 0] = (center_x - w / 2).astype(np.int32)
+    boxes[:, 1] = (center_y - h / 2).astype(np.int32)
+    boxes[:, 2] = w
+    boxes[:, 3] = h
+    return boxes
+
+# Shared detector, loaded on first use by get_detector
+_instance = None
+_instance_lock = threading.Lock()
+
+def get_detector(input_size=416, use_opencl=False):
+    """Return the process-wide YOLODetector, loading the model on the first call"""
+    global _instance
+    if _instance is None:
+        with _instance_lock:
+            if _instance is None:
+                _instance = YOLODetector(input_size=input_size, use_opencl=use_opencl)
+    return _instance
+
 class YOLODetector:
-    def __init__(self):
+    def __init__(self, input_size=416, use_opencl=False):
         self.net = None
         self.output_layers = None
-        self.classes = []
+        self.classes = np.array([], dtype='U24')
         self.confidence_threshold = 0.5
         self.nms_threshold = 0.4
+        self.input_size = input_size  # network input side, a multiple of 32
+        self.input_scale = np.float32(0.00392)
+        self.use_opencl = use_opencl and opencl_available()
+        if self.use_opencl:
+            cv2.ocl.setUseOpenCL(True)
+        
+        # Reused every frame instead of letting blobFromImage allocate a new tensor
+        self._resize_buf = np.empty((self.input_size, self.input_size, 3), dtype=np.uint8)
+        self._blob = np.empty((1, 3, self.input_size, self.input_size), dtype=np.float32)
+        self._lock = threading.Lock()
         self.load_model()
+        
+        # Fallback classes get fixed ids too, so the class table never changes after loading
+        self.person_class_id = self.class_id('person')
+        self.moving_class_id = self.class_id('moving_object')
+        
+        # The HOG detector is built once rather than on every fallback call; background
+        # subtractors hold per-video state, so callers create their own with create_background_model
+        try:
+            self._hog = cv2.HOGDescriptor()
+            self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        except AttributeError:  # HOG is not part of every OpenCV build
+            self._hog = None
+    
+    def create_background_model(self):
+        """Create a background subtractor for the fallback detector, one per video"""
+        return cv2.createBackgroundSubtractorMOG2()
     
     def load_model(self):
         """Load YOLO model and configuration"""
@@ -47,13 +122,19 @@ class YOLODetector:
             # Load the network
             self.net = cv2.dnn.readNet(weights_path, config_path)
             
+            # Prefer FP16 inference on the GPU when OpenCV was built with CUDA
+            if cuda_available():
+                self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+                self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA_FP16)
+                logging.info("YOLO using CUDA FP16 backend")
+            
             # Get output layer names
             layer_names = self.net.getLayerNames()
             self.output_layers = [layer_names[i - 1] for i in self.net.getUnconnectedOutLayers()]
             
             # Load class names
             with open(classes_path, 'r') as f:
-                self.classes = [line.strip() for line in f.readlines()]
+                self.classes = np.array([line.strip() for line in f.readlines()], dtype='U24')
             
             logging.info("YOLO model loaded successfully")
             
@@ -62,105 +143,120 @@ class YOLODetector:
             # Fallback to OpenCV's built-in object detection
             self.use_fallback_detection = True
     
-    def detect(self, frame):
+    def detect(self, frame, bg_subtractor=None):
         """Detect objects in frame"""
-        try:
-            if self.net is None:
-                return self.fallback_detection(frame)
-            
-            height, width, channels = frame.shape
-            
-            # Prepare input blob
-            blob = cv2.dnn.blobFromImage(frame, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-            self.net.setInput(blob)
-            
-            # Run inference
-            outputs = self.net.forward(self.output_layers)
-            
-            # Process outputs
-            boxes = []
-            confidences = []
-            class_ids = []
-            
-            for output in outputs:
-                for detection in output:
-                    scores = detection[5:]
-                    class_id = np.argmax(scores)
-                    confidence = scores[class_id]
-                    
-                    if confidence > self.confidence_threshold:
-                        # Object detected
-                        center_x = int(detection[0] * width)
-                        center_y = int(detection[1] * height)
-                        w = int(detection[2] * width)
-                        h = int(detection[3] * height)
-                        
-                        # Rectangle coordinates
-                        x = int(center_x - w / 2)
-                        y = int(center_y - h / 2)
-                        
-                        boxes.append([x, y, w, h])
-                        confidences.append(float(confidence))
-                        class_ids.append(class_id)
-            
-            # Apply non-maximum suppression
-            indexes = cv2.dnn.NMSBoxes(boxes, confidences, self.confidence_threshold, self.nms_threshold)
-            
-            detections = []
-            if len(indexes) > 0:
-                for i in indexes.flatten():
-                    x, y, w, h = boxes[i]
-                    class_name = self.classes[class_ids[i]] if class_ids[i] < len(self.classes) else "unknown"
-                    
-                    detections.append({
-                        'class': class_name,
-                        'confidence': confidences[i],
-                        'bbox': [x, y, w, h]
-                    })
-            
-            return detections
+        return self.detect_batch([frame], bg_subtractor)[0]
+    
+    def detect_batch(self, frames, bg_subtractor=None):
+        """Detect objects in several frames with a single forward pass"""
+        if self.net is None:
+            return [self.fallback_detection(frame, bg_subtractor) for frame in frames]
+        
+        # The net and the blob buffers are shared by every processor thread
+        with self._lock:
+            try:
+                # Prepare input blob
+                self.net.setInput(self.prepare_blob(frames))
+                
+                # Run inference
+                outputs = self.net.forward(self.output_layers)
+                
+                # Every output layer stacks all frames' rows, split them back per frame
+                outputs = [output.reshape(len(frames), -1, output.shape[-1]) for output in outputs]
+                return [self.postprocess([output[i] for output in outputs], frame.shape[1], frame.shape[0])
+                        for i, frame in enumerate(frames)]
+                
+            except Exception as e:
+                logging.error(f"Error in YOLO detection: {str(e)}")
+        
+        return [self.fallback_detection(frame, bg_subtractor) for frame in frames]
+    
+    def postprocess(self, outputs, width, height):
+        """Decode one frame's network outputs and apply NMS"""
+        # Process outputs
+        boxes, confidences, class_ids = self.decode_outputs(outputs, width, height)
             
-        except Exception as e:
-            logging.error(f"Error in YOLO detection: {str(e)}")
-            return self.fallback_detection(frame)
+        # Apply non-maximum suppression
+        indexes = cv2.dnn.NMSBoxes(boxes, confidences, self.confidence_threshold, self.nms_threshold)
+        
+        kept = np.asarray(indexes, dtype=np.int64).reshape(-1)
+        detections = np.empty(len(kept), dtype=DET_DTYPE)
+        detections['class_id'] = class_ids[kept]
+        detections['conf'] = confidences[kept]
+        detections['x'] = boxes[kept, 0]
+        detections['y'] = boxes[kept, 1]
+        detections['w'] = boxes[kept, 2]
+        detections['h'] = boxes[kept, 3]
+        detections['track_id'] = -1
+        
+        return detections
+    
+    def class_id(self, class_name):
+        """Index of class_name in the class table, appending it if missing"""
+        matches = np.flatnonzero(self.classes == class_name)
+        if len(matches):
+            return int(matches[0])
+        self.classes = np.append(self.classes, class_name)
+        return len(self.classes) - 1
     
-    def fallback_detection(self, frame):
+    def class_names(self, class_ids):
+        """Names for an array of class ids, gathered in one step"""
+        return self.classes[class_ids].tolist()
+    
+    def prepare_blob(self, frames):
+        """Resize, swap to RGB and scale frames into the reused NCHW input blob"""
+        if len(frames) > self._blob.shape[0]:
+            self._blob = np.empty((len(frames), 3, self.input_size, self.input_size), dtype=np.float32)
+        
+        for i, frame in enumerate(frames):
+            # Area averaging keeps small objects from aliasing away when shrinking high-res frames
+            if frame.shape[0] > self.input_size or frame.shape[1] > self.input_size:
+                interpolation = cv2.INTER_AREA
+            else:
+                interpolation = cv2.INTER_LINEAR
+            if self.use_opencl:
+                # Resize on the OpenCL device and only download the small result
+                resized = cv2.resize(cv2.UMat(frame), (self.input_size, self.input_size), interpolation=interpolation).get()
+            else:
+                resized = cv2.resize(frame, (self.input_size, self.input_size), dst=self._resize_buf, interpolation=interpolation)
+            np.multiply(resized[:, :, ::-1].transpose(2, 0, 1), self.input_scale, out=self._blob[i])
+        return self._blob[:len(frames)]
+    
+    def decode_outputs(self, outputs, width, height):
+        """Pick the best class per output row and keep the rows above the confidence threshold"""
+        all_out = np.concatenate(outputs, axis=0)
+        scores = all_out[:, 5:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        
+        mask = confidences > self.confidence_threshold
+        boxes = _decode_boxes(all_out[mask], np.float32(width), np.float32(height))
+        return boxes, confidences[mask], class_ids[mask]
+    
+    def fallback_detection(self, frame, bg_subtractor=None):
         """Fallback detection using OpenCV's built-in methods"""
-        detections = []
+        rows = []
         
         try:
             # Use HOG descriptor for person detection
-            hog = cv2.HOGDescriptor()
-            hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+            if self._hog is not None:
+                boxes, weights = self._hog.detectMultiScale(frame, winStride=(8, 8))
+                
+                for (x, y, w, h) in boxes:
+                    rows.append((self.person_class_id, 0.7, x, y, w, h, -1))  # Default confidence for HOG detection
             
-            # Detect people
-            boxes, weights = hog.detectMultiScale(frame, winStride=(8, 8))
-            
-            for (x, y, w, h) in boxes:
-                detections.append({
-                    'class': 'person',
-                    'confidence': 0.7,  # Default confidence for HOG detection
-                    'bbox': [x, y, w, h]
-                })
-            
-            # Use background subtraction for moving objects
-            if not hasattr(self, 'bg_subtractor'):
-                self.bg_subtractor = cv2.createBackgroundSubtractorMOG2()
-            
-            fg_mask = self.bg_subtractor.apply(frame)
-            contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                if area > 500:  # Filter small objects
-                    x, y, w, h = cv2.boundingRect(contour)
-                    detections.append({
-                        'class': 'moving_object',
-                        'confidence': 0.6,
-                        'bbox': [x, y, w, h]
-                    })
+            # Use background subtraction for moving objects, when the caller tracks a background
+            if bg_subtractor is not None:
+                fg_mask = bg_subtractor.apply(frame)
+                contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                
+                for contour in contours:
+                    area = cv2.contourArea(contour)
+                    if area > 500:  # Filter small objects
+                        x, y, w, h = cv2.boundingRect(contour)
+                        rows.append((self.moving_class_id, 0.6, x, y, w, h, -1))
             
         except Exception as e:
             logging.error(f"Error in fallback detection: {str(e)}")
         
-        return detections
+        return np.array(rows, dtype=DET_DTYPE)